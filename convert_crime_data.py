@@ -0,0 +1,45 @@
+"""
+berlin_crime_2024.csv -> berlin_crime_2024.parquet 변환 스크립트 (한 번만 실행)
+
+    $ python convert_crime_data.py
+
+앱(load_and_process_crime_data)은 Parquet 파일이 있으면 필요한 컬럼만 읽고,
+없으면 기존처럼 CSV를 파싱합니다.
+
+입력은 베를린 경찰 Fallzahlen 원본 내보내기 형식(UTF-8, LOR-Schlüssel /
+Bezeichnung / Straftaten -insgesamt- 컬럼 포함)이어야 합니다.
+현재 저장소에 들어 있는 berlin_crime_2024.csv는 이 형식이 아니어서(인코딩 깨짐,
+지역 코드/이름 컬럼 없음) 변환되지 않고 오류 메시지와 함께 종료됩니다.
+"""
+import sys
+import pandas as pd
+
+CSV_FILE = "berlin_crime_2024.csv"
+PARQUET_FILE = "berlin_crime_2024.parquet"
+
+
+def main(csv_file=CSV_FILE, parquet_file=PARQUET_FILE):
+    try:
+        df = pd.read_csv(csv_file, dtype={'LOR-Schlüssel (Bezirksregion)': str}, thousands=',', encoding='utf-8')
+    except UnicodeDecodeError:
+        sys.exit(f"{csv_file}이(가) UTF-8 파일이 아닙니다. Fallzahlen 원본 CSV를 UTF-8로 내보내 주세요.")
+
+    # 컬럼명에 줄바꿈 제거 및 정리
+    df.columns = df.columns.str.replace('\n', '', regex=False).str.strip()
+
+    missing = [c for c in ['LOR-Schlüssel (Bezirksregion)', 'Bezeichnung (Bezirksregion)'] if c not in df.columns]
+    if missing:
+        sys.exit(f"CSV에 필요한 컬럼이 없습니다: {', '.join(missing)}")
+
+    # 'Straftaten -insgesamt-' 컬럼을 고정된 이름으로 통일 (앱에서 columns=로 바로 읽기 위함)
+    total_col = df.columns[df.columns.str.contains('Straftaten') & df.columns.str.contains('insgesamt')]
+    if total_col.empty:
+        sys.exit("CSV에서 범죄 총계 컬럼을 찾을 수 없습니다.")
+    df = df.rename(columns={total_col[0]: 'Straftaten insgesamt'})
+
+    df.to_parquet(parquet_file, engine='pyarrow', compression='snappy')
+    print(f"{parquet_file} 저장 완료 ({len(df)} rows)")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
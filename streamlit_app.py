@@ -1,8 +1,23 @@
+import os
+import copy
+import functools
+import hashlib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import pandas as pd
 import folium
+import branca.colormap
+from folium.plugins import FastMarkerCluster
 from streamlit_folium import st_folium
 import requests
+import ijson
+import diskcache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import google.generativeai as genai
 import googlemaps
 
@@ -28,90 +43,208 @@ if GEMINI_API_KEY:
     except:
         pass
 
+# HTTP 세션 (keep-alive 연결 재사용)
+# Streamlit은 매 rerun마다 스크립트를 처음부터 다시 실행하므로, cache_resource로 하나만 만들어 둡니다.
+@st.cache_resource
+def get_http_session():
+    session = requests.Session()
+    session.headers.update({'User-Agent': 'BerlinApp/1.0'})
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=Retry(total=2, backoff_factor=0.3))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+SESSION = get_http_session()
+
+# 디스크 캐시 (앱 재시작 후에도 유지, 그 위에 @st.cache_data가 메모리 캐시로 올라감)
+@st.cache_resource
+def get_disk_cache():
+    return diskcache.Cache('.streamlit_cache')
+
+DISK_CACHE = get_disk_cache()
+
+def disk_cache_key(*parts):
+    return hashlib.sha256("|".join(str(p) for p in parts).encode()).hexdigest()
+
 # ---------------------------------------------------------
 # 2. 데이터 처리 함수 (독일어 원본 데이터 대응)
 # ---------------------------------------------------------
-@st.cache_data
+@st.cache_data(ttl=3600)
 def get_exchange_rate():
+    key = disk_cache_key('exchange_rate', 'EUR', 'KRW')
+    cached = DISK_CACHE.get(key)
+    if cached is not None:
+        return cached
     try:
         url = "https://api.exchangerate-api.com/v4/latest/EUR"
-        data = requests.get(url).json()
-        return data['rates']['KRW']
+        data = SESSION.get(url, timeout=5).json()
+        rate = data['rates']['KRW']
+        DISK_CACHE.set(key, rate, expire=3600)
+        return rate
     except:
         return 1450.0
 
-@st.cache_data
+@st.cache_data(ttl=600)
 def get_weather():
     try:
         url = "https://api.open-meteo.com/v1/forecast?latitude=52.52&longitude=13.41&current_weather=true"
-        data = requests.get(url).json()
+        data = SESSION.get(url, timeout=5).json()
         return data['current_weather']
     except:
         return {"temperature": 15.0, "weathercode": 0}
 
-@st.cache_data
-def get_osm_places(category, lat, lng, radius_m=2000, cuisine_filter=None):
+OSM_TAGS = {
+    'restaurant': '["amenity"="restaurant"]',
+    'hotel': '["tourism"="hotel"]',
+    'tourism': '["tourism"~"attraction|museum|artwork|viewpoint"]',
+}
+TOURISM_VALUES = ('attraction', 'museum', 'artwork', 'viewpoint')
+
+def classify_osm_element(tags):
+    """
+    노드의 태그를 보고 속하는 카테고리(restaurant/hotel/tourism)를 모두 돌려줍니다.
+    예: amenity=restaurant + tourism=hotel 노드는 식당이면서 호텔입니다.
+    """
+    matched = []
+    if tags.get('amenity') == 'restaurant':
+        matched.append('restaurant')
+    tourism = tags.get('tourism', '')
+    if tourism == 'hotel':
+        matched.append('hotel')
+    if any(x in tourism for x in TOURISM_VALUES):
+        matched.append('tourism')
+    return matched
+
+# 음식 종류별 cuisine 키워드 (dict 순서 = 우선순위, 예: "coffee;italian" -> 양식)
+CUISINE_KEYWORDS = {
+    "한식": ['korean'],
+    "양식": ['burger', 'pizza', 'italian', 'french', 'german', 'american', 'steak'],
+    "아시안": ['chinese', 'vietnamese', 'thai', 'japanese', 'sushi', 'asian', 'indian'],
+    "카페": ['coffee', 'cafe', 'cake'],
+}
+
+@functools.lru_cache(maxsize=1024)
+def classify_cuisine_token(token):
+    """
+    cuisine 값 하나를 키워드 부분 일치로 분류합니다 (예: coffee_shop -> 카페).
+    cuisine은 "pizza;italian" 처럼 ';'로 여러 개가 올 수 있어서 토큰 단위로 부르고, 결과는 토큰별로 캐시됩니다.
+    """
+    for place_type, keywords in CUISINE_KEYWORDS.items():
+        if any(k in token for k in keywords):
+            return place_type
+    return None
+
+def classify_cuisine(cuisine):
+    matched = {classify_cuisine_token(t.strip()) for t in cuisine.split(';')}
+    return next((t for t in CUISINE_KEYWORDS if t in matched), "일반/기타")
+
+# 음식점 마커 색상 (나머지는 green)
+CUISINE_COLORS = {'한식': 'red', '카페': 'beige'}
+
+# FastMarkerCluster 콜백: row = [lat, lng, color, popup]
+RESTAURANT_MARKER_JS = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+        radius: 5, color: row[2], fill: true, fillOpacity: 0.8
+    });
+    marker.bindPopup(row[3]);
+    return marker;
+};
+"""
+
+@st.cache_data(ttl=86400, max_entries=50)
+def get_osm_places_multi(categories, lat, lng, radius_m=2000):
+    """
+    여러 카테고리를 Overpass union 쿼리 한 번으로 가져와
+    {카테고리: [장소, ...]} 형태로 나눠서 돌려줍니다.
+    음식 종류 필터는 캐시 키에 넣지 않고, 호출한 쪽에서 filter_by_cuisine()으로 적용합니다.
+    """
     overpass_url = "http://overpass-api.de/api/interpreter"
-    
-    if category == 'restaurant':
-        tag = '["amenity"="restaurant"]'
-    elif category == 'hotel':
-        tag = '["tourism"="hotel"]'
-    elif category == 'tourism':
-        tag = '["tourism"~"attraction|museum|artwork|viewpoint"]'
-    else:
-        return []
+    categories = tuple(c for c in categories if c in OSM_TAGS)
+    results = {c: [] for c in categories}
+    if not categories:
+        return results
+
+    key = disk_cache_key('osm', categories, lat, lng, radius_m)
+    cached = DISK_CACHE.get(key)
+    if cached is not None:
+        return cached
 
+    nodes = "\n".join(
+        f"      node{OSM_TAGS[c]}(around:{radius_m},{lat},{lng});" for c in categories
+    )
     query = f"""
     [out:json];
     (
-      node{tag}(around:{radius_m},{lat},{lng});
+{nodes}
     );
     out body;
     """
     
     try:
-        response = requests.get(overpass_url, params={'data': query})
-        data = response.json()
-        
-        results = []
-        for element in data['elements']:
-            if 'tags' in element and 'name' in element['tags']:
-                cuisine = element['tags'].get('cuisine', 'general').lower()
-                name = element['tags']['name']
-                
-                place_type = "기타"
-                if category == 'restaurant':
-                    if 'korean' in cuisine: place_type = "한식"
-                    elif any(x in cuisine for x in ['burger', 'pizza', 'italian', 'french', 'german', 'american', 'steak']): place_type = "양식"
-                    elif any(x in cuisine for x in ['chinese', 'vietnamese', 'thai', 'japanese', 'sushi', 'asian', 'indian']): place_type = "아시안"
-                    elif any(x in cuisine for x in ['coffee', 'cafe', 'cake']): place_type = "카페"
-                    else: place_type = "일반/기타"
-                        
-                    if cuisine_filter and "전체" not in cuisine_filter: 
-                        if place_type not in cuisine_filter: continue
-
-                results.append({
-                    "name": name,
-                    "lat": element['lat'],
-                    "lng": element['lon'],
-                    "type": category,
-                    "cuisine_type": place_type,
-                    "raw_cuisine": cuisine
-                })
+        # 응답 전체를 dict로 올리지 않고, elements를 하나씩 스트리밍 파싱합니다.
+        with SESSION.get(overpass_url, params={'data': query}, timeout=25, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True  # gzip 응답 대응
+            for element in ijson.items(response.raw, 'elements.item', use_float=True):
+                tags = element.get('tags')
+                if not tags or 'name' not in tags: continue
+                cuisine = tags.get('cuisine', 'general').lower()
+                for category in classify_osm_element(tags):
+                    if category not in results: continue
+                    place_type = classify_cuisine(cuisine) if category == 'restaurant' else "기타"
+                    results[category].append({
+                        "name": tags['name'],
+                        "lat": element['lat'],
+                        "lng": element['lon'],
+                        "type": category,
+                        "cuisine_type": place_type,
+                        "raw_cuisine": cuisine
+                    })
+        DISK_CACHE.set(key, results, expire=3600)
         return results
     except Exception:
-        return []
+        return {c: [] for c in categories}
+
+def filter_by_cuisine(places, cuisine_filter):
+    """선택한 음식 종류만 남깁니다 ("전체"가 있거나 선택이 없으면 그대로)."""
+    if not cuisine_filter or "전체" in cuisine_filter:
+        return places
+    allowed_types = frozenset(cuisine_filter)
+    return [p for p in places if p['cuisine_type'] in allowed_types]
+
+CRIME_COLUMNS = ['LOR-Schlüssel (Bezirksregion)', 'Bezeichnung (Bezirksregion)', 'Straftaten insgesamt']
 
-@st.cache_data
+@st.cache_data(ttl=86400, max_entries=5)
 def load_and_process_crime_data(csv_file):
     """
     독일어 원본 CSV (Fallzahlen_2024.csv)를 처리하여 
     GeoJSON과 매칭되는 데이터프레임을 만듭니다.
+    같은 이름의 .parquet 파일(convert_crime_data.py로 생성)이 있으면 그것을 먼저 읽습니다.
     """
     try:
-        # 1. 파일 읽기 (독일어 인코딩 고려, 보통 utf-8 or latin1)
-        df = pd.read_csv(csv_file, dtype={'LOR-Schlüssel (Bezirksregion)': str})
+        # 1. 파일 읽기: Parquet가 있으면 필요한 3개 컬럼만 읽고, 없으면 CSV로 대체
+        parquet_file = os.path.splitext(csv_file)[0] + ".parquet"
+        if os.path.exists(parquet_file):
+            df = pd.read_parquet(parquet_file, columns=CRIME_COLUMNS)
+        else:
+            # 헤더만 먼저 읽어서 필요한 3개 컬럼(원본 이름, 줄바꿈 포함)을 찾은 뒤 그 컬럼만 파싱합니다.
+            # 독일어 인코딩 고려, 보통 utf-8 or latin1
+            header = pd.read_csv(csv_file, nrows=0, encoding='utf-8').columns
+            clean = header.str.replace('\n', '', regex=False).str.strip()
+            total_raw = header[clean.str.contains('Straftaten') & clean.str.contains('insgesamt')]
+            key_raw = header[clean.isin(['LOR-Schlüssel (Bezirksregion)', 'Bezeichnung (Bezirksregion)'])]
+            usecols = list(key_raw) + list(total_raw[:1])
+            df = pd.read_csv(
+                csv_file,
+                sep=',',
+                usecols=usecols,
+                dtype={c: 'string' for c in key_raw},
+                thousands=',',  # 숫자가 "39,391" 형식
+                encoding='utf-8'
+            )
+            if len(total_raw):
+                df[total_raw[0]] = df[total_raw[0]].astype('Int64')
         
         # 2. 필요한 컬럼 찾기 (독일어 헤더 대응)
         # LOR-Schlüssel: 지역 코드 (010000 처럼 끝이 0000인 것이 구 전체 통계)
@@ -119,11 +252,11 @@ def load_and_process_crime_data(csv_file):
         # Straftaten -insgesamt-: 총 범죄 수 (줄바꿈 문자 포함될 수 있음)
         
         # 컬럼명에 줄바꿈 제거 및 정리
-        df.columns = [c.replace('\n', '').strip() for c in df.columns]
+        df.columns = df.columns.str.replace('\n', '', regex=False).str.strip()
         
         # 'Straftaten -insgesamt-' 컬럼 찾기
-        total_col = [c for c in df.columns if 'Straftaten' in c and 'insgesamt' in c]
-        if not total_col:
+        total_col = df.columns[df.columns.str.contains('Straftaten') & df.columns.str.contains('insgesamt')]
+        if total_col.empty:
             st.error("CSV에서 범죄 총계 컬럼을 찾을 수 없습니다.")
             return pd.DataFrame()
         total_col = total_col[0]
@@ -132,7 +265,10 @@ def load_and_process_crime_data(csv_file):
         # LOR 코드가 '0000'으로 끝나는 행이 해당 구의 합계 데이터입니다.
         # 예: 010000 -> Mitte 합계, 011001 -> Tiergarten (하위 지역)
         # 하위 지역을 다 더하면 중복되므로, 합계 행만 가져옵니다.
-        df_district = df[df['LOR-Schlüssel (Bezirksregion)'].str.endswith('0000', na=False)].copy()
+        # 문자열 비교 대신 숫자로 한 번 변환한 뒤 나머지 연산으로 걸러냅니다.
+        codes = pd.to_numeric(df['LOR-Schlüssel (Bezirksregion)'], errors='coerce')
+        mask = (codes % 10000 == 0) & codes.notna()
+        df_district = df.loc[mask].copy()
         
         # 4. 컬럼 이름 변경 (GeoJSON 매칭용)
         df_district = df_district.rename(columns={
@@ -151,24 +287,78 @@ def load_and_process_crime_data(csv_file):
         # st.error(f"데이터 처리 오류: {e}") # 디버깅용
         return pd.DataFrame()
 
+def crime_colormap(vmin, vmax):
+    return branca.colormap.linear.YlOrRd_09.scale(vmin, vmax)
+
+@st.cache_data(ttl=86400, max_entries=5)
+def build_crime_color_map(crime_df):
+    """
+    구 이름 -> 채우기 색상(hex) 매핑을 미리 계산합니다.
+    GeoJson style_function에서는 dict 조회만 하면 됩니다.
+    """
+    totals = pd.to_numeric(crime_df['Total_Crime'], errors='coerce')
+    vmin, vmax = float(totals.min()), float(totals.max())
+    cmap = crime_colormap(vmin, vmax)
+    color_map = {
+        district: cmap(total)
+        for district, total in zip(crime_df['District'], totals)
+        if pd.notna(total)
+    }
+    return color_map, vmin, vmax
+
+BERLIN_GEOJSON_URL = "https://raw.githubusercontent.com/funkeinteraktiv/Berlin-Geodaten/master/berlin_bezirke.geojson"
+
+@st.cache_data(ttl=86400)
+def load_berlin_geojson():
+    """
+    베를린 구(Bezirke) 경계 GeoJSON을 한 번만 내려받아 dict로 보관합니다.
+    실패 시 예외를 그대로 올려서, 실패 결과가 캐시에 남지 않도록 합니다.
+    """
+    res = SESSION.get(BERLIN_GEOJSON_URL, timeout=5)
+    res.raise_for_status()
+    return res.json()
+
+# AI 대화 기록은 최근 MAX_HISTORY개 메시지만 보관 (매 rerun마다 전부 다시 그리므로)
+MAX_HISTORY = 50
+
+@st.cache_resource
+def get_gemini_model():
+    return genai.GenerativeModel('gemini-pro')
+
 def get_gemini_response(prompt):
     if not GEMINI_API_KEY: return "API 키가 필요합니다."
     try:
-        model = genai.GenerativeModel('gemini-pro')
+        model = get_gemini_model()
         response = model.generate_content(prompt)
         return response.text
     except: return "AI 응답 오류"
 
+# Nominatim 사용 정책: 초당 1회 이하 요청
+NOMINATIM_MIN_INTERVAL = 1.0
+
+@st.cache_resource
+def get_nominatim_throttle():
+    """모든 세션이 공유하는 Nominatim 호출 간격 제한용 상태"""
+    return {"lock": threading.Lock(), "last_call": 0.0}
+
+@st.cache_data(ttl=86400)
 def search_location(query):
-    try:
-        url = "https://nominatim.openstreetmap.org/search"
-        params = {'q': query, 'format': 'json', 'limit': 1}
-        headers = {'User-Agent': 'BerlinApp/1.0'}
-        res = requests.get(url, params=params, headers=headers).json()
-        if res:
-            return float(res[0]['lat']), float(res[0]['lon']), res[0]['display_name']
-    except:
-        pass
+    """
+    Nominatim으로 장소를 검색합니다. 검색 결과가 없으면 (None, None, None)을 돌려줍니다.
+    네트워크/HTTP 오류는 예외를 그대로 올려서, 실패 결과가 캐시에 남지 않도록 합니다.
+    """
+    url = "https://nominatim.openstreetmap.org/search"
+    params = {'q': query, 'format': 'json', 'limit': 1}
+    throttle = get_nominatim_throttle()
+    with throttle["lock"]:
+        wait = NOMINATIM_MIN_INTERVAL - (time.time() - throttle["last_call"])
+        if wait > 0: time.sleep(wait)
+        throttle["last_call"] = time.time()
+        response = SESSION.get(url, params=params, timeout=5)
+    response.raise_for_status()
+    res = response.json()
+    if res:
+        return float(res[0]['lat']), float(res[0]['lon']), res[0]['display_name']
     return None, None, None
 
 # ---------------------------------------------------------
@@ -225,6 +415,34 @@ courses = {
     ]
 }
 
+# 리뷰용 장소 목록 (번호 접두어 "1. " 제거, courses가 고정값이므로 한 번만 계산)
+ALL_PLACES_LIST = sorted({(p['name'].split(". ", 1)[1] if ". " in p['name'] else p['name']) for v in courses.values() for p in v})
+
+@st.cache_resource
+def base_map(zoom):
+    """자유 탐험 탭의 기본 지도 (타일/CRS/Leaflet 설정만, 마커 없음). 캐시된 객체이므로 꼭 복사해서 사용합니다."""
+    # 중심 좌표는 복사본에 지정하므로 캐시 키는 zoom 하나뿐입니다.
+    # prefer_canvas: 수백 개의 식당 마커를 DOM 노드 대신 하나의 canvas에 그림
+    return folium.Map(location=[52.5200, 13.4050], zoom_start=zoom, prefer_canvas=True)
+
+@st.cache_resource
+def build_theme_map(theme_name):
+    """테마 코스 지도는 고정 데이터이므로 테마별로 한 번만 만들어 재사용합니다. 캐시된 객체이므로 꼭 복사해서 사용합니다."""
+    c_data = courses[theme_name]
+    m = folium.Map(location=[c_data[2]['lat'], c_data[2]['lng']], zoom_start=13)
+    points = []
+    for i, item in enumerate(c_data):
+        loc = [item['lat'], item['lng']]
+        points.append(loc)
+        color = 'orange' if item['type'] == 'food' else 'blue'
+        icon = 'cutlery' if item['type'] == 'food' else 'camera'
+        folium.Marker(
+            loc, popup=item['name'], tooltip=f"{i+1}. {item['name']}",
+            icon=folium.Icon(color=color, icon=icon)
+        ).add_to(m)
+    folium.PolyLine(points, color="red", weight=4, opacity=0.7).add_to(m)
+    return m
+
 # ---------------------------------------------------------
 # 4. 메인 화면 구성
 # ---------------------------------------------------------
@@ -238,13 +456,19 @@ if 'messages' not in st.session_state: st.session_state['messages'] = []
 if 'map_center' not in st.session_state: st.session_state['map_center'] = [52.5200, 13.4050]
 if 'search_marker' not in st.session_state: st.session_state['search_marker'] = None
 
-# [1] 환율 & 날씨
+# [1] 환율 & 날씨 (서로 독립적인 요청이라 동시에 가져옵니다)
+# 작업 스레드에도 현재 ScriptRunContext를 붙여서 캐시 스피너/경고가 정상 동작하도록 합니다.
+script_ctx = get_script_run_ctx()
+with ThreadPoolExecutor(max_workers=4, initializer=lambda: add_script_run_ctx(threading.current_thread(), script_ctx)) as ex:
+    rate_future = ex.submit(get_exchange_rate)
+    weather_future = ex.submit(get_weather)
+    rate = rate_future.result()
+    w = weather_future.result()
+
 col1, col2 = st.columns(2)
 with col1:
-    rate = get_exchange_rate()
     st.metric(label="💶 현재 유로 환율", value=f"{rate:.0f}원", delta="1 EUR 기준")
 with col2:
-    w = get_weather()
     st.metric(label="⛅ 베를린 기온", value=f"{w['temperature']}°C")
 
 st.divider()
@@ -254,15 +478,21 @@ st.sidebar.title("🛠️ 여행 도구")
 
 # 1. 검색
 st.sidebar.subheader("🔍 장소 찾기")
-search_query = st.sidebar.text_input("장소 이름 (예: Curry 36)", placeholder="엔터키를 누르면 검색됩니다")
-if search_query:
-    lat, lng, name = search_location(search_query + " Berlin")
-    if lat and lng:
-        st.session_state['map_center'] = [lat, lng]
-        st.session_state['search_marker'] = {"lat": lat, "lng": lng, "name": name}
-        st.sidebar.success(f"이동: {name}")
+with st.sidebar.form("search_form"):
+    search_query = st.text_input("장소 이름 (예: Curry 36)", placeholder="엔터키를 누르면 검색됩니다")
+    search_submitted = st.form_submit_button("검색")
+if search_submitted and search_query:
+    try:
+        lat, lng, name = search_location(search_query + " Berlin")
+    except:
+        st.sidebar.error("검색 서비스에 연결할 수 없습니다. 잠시 후 다시 시도해 주세요.")
     else:
-        st.sidebar.error("장소를 찾을 수 없습니다.")
+        if lat and lng:
+            st.session_state['map_center'] = [lat, lng]
+            st.session_state['search_marker'] = {"lat": lat, "lng": lng, "name": name}
+            st.sidebar.success(f"이동: {name}")
+        else:
+            st.sidebar.error("장소를 찾을 수 없습니다.")
 
 st.sidebar.divider()
 
@@ -284,7 +514,9 @@ tab1, tab2, tab3 = st.tabs(["🗺️ 자유 탐험", "🚩 추천 코스 (6 Them
 # =========================================================
 with tab1:
     center = st.session_state['map_center']
-    m1 = folium.Map(location=center, zoom_start=13)
+    # 마커 없는 기본 지도는 캐시해 두고, 매 rerun마다 복사본에 마커만 추가합니다.
+    m1 = copy.deepcopy(base_map(13))
+    m1.location = list(center)
 
     if st.session_state['search_marker']:
         sm = st.session_state['search_marker']
@@ -297,38 +529,53 @@ with tab1:
     # 1. 범죄 지도 (berlin_crime_2024.csv 사용)
     if show_crime:
         crime_df = load_and_process_crime_data("berlin_crime_2024.csv")
-        if not crime_df.empty:
-            folium.Choropleth(
-                geo_data="https://raw.githubusercontent.com/funkeinteraktiv/Berlin-Geodaten/master/berlin_bezirke.geojson",
-                data=crime_df,
-                columns=["District", "Total_Crime"],
-                key_on="feature.properties.name",
-                fill_color="YlOrRd",
-                fill_opacity=0.4,
-                line_opacity=0.2,
+        berlin_geo = None
+        if crime_df.empty:
+            st.warning("범죄 데이터(berlin_crime_2024.csv)를 찾을 수 없습니다.")
+        else:
+            # 범죄 레이어를 실제로 그릴 때만 경계 데이터를 가져옵니다.
+            try:
+                berlin_geo = load_berlin_geojson()
+            except:
+                st.warning("베를린 구 경계 데이터를 불러올 수 없습니다.")
+        if berlin_geo:
+            color_map, vmin, vmax = build_crime_color_map(crime_df)
+            folium.GeoJson(
+                berlin_geo,
+                style_function=lambda f: {
+                    'fillColor': color_map.get(f['properties']['name'], 'black'),
+                    'color': 'black',
+                    'weight': 1,
+                    'fillOpacity': 0.4,
+                    'opacity': 0.2,
+                },
                 name="범죄"
             ).add_to(m1)
-        else:
-            st.warning("범죄 데이터(berlin_crime_2024.csv)를 찾을 수 없습니다.")
+            crime_colormap(vmin, vmax).add_to(m1)
+
+    # 2. 음식점 / 호텔 / 관광지 (Overpass 한 번에 조회)
+    osm_categories = []
+    if selected_cuisines: osm_categories.append('restaurant')
+    if show_hotel: osm_categories.append('hotel')
+    if show_tour: osm_categories.append('tourism')
+    osm_places = get_osm_places_multi(tuple(osm_categories), center[0], center[1], 3000)
 
-    # 2. 음식점
     if selected_cuisines:
-        places = get_osm_places('restaurant', center[0], center[1], 3000, selected_cuisines)
-        fg_food = folium.FeatureGroup(name="식당")
-        for p in places:
-            c_color = 'green'
-            if p['cuisine_type'] == '한식': c_color = 'red'
-            elif p['cuisine_type'] == '카페': c_color = 'beige'
-            
-            popup_html = f"<b>{p['name']}</b><br>({p['cuisine_type']})"
-            folium.CircleMarker(
-                [p['lat'], p['lng']], radius=5, color=c_color, fill=True, popup=popup_html, fill_opacity=0.8
-            ).add_to(fg_food)
-        fg_food.add_to(m1)
+        places = filter_by_cuisine(osm_places['restaurant'], selected_cuisines)
+        if places:
+            # 마커마다 파이썬에서 템플릿을 렌더링하지 않고, 좌표/색/팝업을 한 번에 JS로 넘깁니다.
+            places_df = pd.DataFrame(places)
+            places_df['color'] = places_df['cuisine_type'].map(CUISINE_COLORS).fillna('green')
+            places_df['popup'] = "<b>" + places_df['name'] + "</b><br>(" + places_df['cuisine_type'] + ")"
+            FastMarkerCluster(
+                places_df[['lat', 'lng', 'color', 'popup']].values.tolist(),
+                callback=RESTAURANT_MARKER_JS,
+                name="식당"
+            ).add_to(m1)
 
     # 3. 호텔 & 관광지
     if show_hotel:
-        hotels = get_osm_places('hotel', center[0], center[1], 3000)
+        hotels = osm_places['hotel']
         fg_hotel = folium.FeatureGroup(name="호텔")
         for h in hotels:
             folium.Marker(
@@ -337,7 +584,7 @@ with tab1:
         fg_hotel.add_to(m1)
 
     if show_tour:
-        tours = get_osm_places('tourism', center[0], center[1], 3000)
+        tours = osm_places['tourism']
         fg_tour = folium.FeatureGroup(name="관광")
         for t in tours:
             folium.CircleMarker(
@@ -359,19 +606,9 @@ with tab2:
     c_col1, c_col2 = st.columns([1.5, 1])
     
     with c_col1:
-        m2 = folium.Map(location=[c_data[2]['lat'], c_data[2]['lng']], zoom_start=13)
-        points = []
-        for i, item in enumerate(c_data):
-            loc = [item['lat'], item['lng']]
-            points.append(loc)
-            color = 'orange' if item['type'] == 'food' else 'blue'
-            icon = 'cutlery' if item['type'] == 'food' else 'camera'
-            folium.Marker(
-                loc, popup=item['name'], tooltip=f"{i+1}. {item['name']}",
-                icon=folium.Icon(color=color, icon=icon)
-            ).add_to(m2)
-        folium.PolyLine(points, color="red", weight=4, opacity=0.7).add_to(m2)
-        st_folium(m2, width="100%", height=500)
+        # st_folium은 넘겨받은 지도를 렌더링하면서 수정하므로, 캐시된 원본 대신 복사본을 넘깁니다.
+        m2 = copy.deepcopy(build_theme_map(selected_theme))
+        st_folium(m2, width="100%", height=500, returned_objects=[])
         
     with c_col2:
         st.markdown(f"### {selected_theme}")
@@ -386,6 +623,49 @@ with tab2:
 # =========================================================
 # TAB 3: 수다방 & AI
 # =========================================================
+# 리뷰/추천 목록은 fragment로 분리해서, 등록/삭제 시 전체 스크립트(지도, API 호출)가 아닌 해당 영역만 다시 그립니다.
+# 삭제는 on_click 콜백에서 처리합니다. 콜백은 다음 실행 전에 호출되므로 별도의 st.rerun()이 필요 없습니다.
+def delete_review(sel_place, review_id):
+    reviews = st.session_state['reviews'][sel_place]
+    reviews[:] = [(u, m) for (u, m) in reviews if u != review_id]
+
+def delete_recommendation(index):
+    if index < len(st.session_state['recommendations']):
+        del st.session_state['recommendations'][index]
+
+@st.fragment
+def render_reviews(sel_place):
+    if sel_place not in st.session_state['reviews']:
+        st.session_state['reviews'][sel_place] = []
+
+    with st.form("msg_form", clear_on_submit=True):
+        txt = st.text_input(f"'{sel_place}' 후기 입력")
+        if st.form_submit_button("등록"):
+            # 리뷰는 (id, 내용) 형태로 저장해서, 삭제 버튼 key가 순서에 따라 바뀌지 않도록 합니다.
+            st.session_state['reviews'][sel_place].append((uuid.uuid4().hex, txt))
+
+    reviews = st.session_state['reviews'][sel_place]
+    if reviews:
+        st.write("---")
+        for u, msg in reviews:
+            c1, c2 = st.columns([8, 1])
+            c1.info(f"🗣️ {msg}")
+            c2.button("🗑️", key=f"del_{sel_place}_{u}", on_click=delete_review, args=(sel_place, u))
+
+@st.fragment
+def render_recommendations():
+    st.subheader("👍 나만의 장소 추천해요")
+    with st.form("recommend_form", clear_on_submit=True):
+        rec_place = st.text_input("장소 이름")
+        rec_desc = st.text_input("이유 (한 줄)")
+        if st.form_submit_button("추천 등록"):
+            st.session_state['recommendations'].insert(0, {"place": rec_place, "desc": rec_desc})
+
+    for i, rec in enumerate(st.session_state['recommendations']):
+        c1, c2 = st.columns([8, 1])
+        c1.success(f"**{rec['place']}**: {rec['desc']}")
+        c2.button("🗑️", key=f"del_rec_{i}", on_click=delete_recommendation, args=(i,))
+
 with tab3:
     col_chat, col_ai = st.columns([1, 1])
     
@@ -393,49 +673,19 @@ with tab3:
     with col_chat:
         st.subheader("💬 장소별 리뷰")
         input_method = st.radio("장소 선택 방식", ["목록에서 선택", "직접 입력하기"], horizontal=True, label_visibility="collapsed")
-        all_places_list = sorted(list(set([p['name'].split(". ")[1] if ". " in p['name'] else p['name'] for v in courses.values() for p in v])))
         
         if input_method == "목록에서 선택":
-            sel_place = st.selectbox("리뷰할 장소", all_places_list)
+            sel_place = st.selectbox("리뷰할 장소", ALL_PLACES_LIST)
         else:
             sel_place = st.text_input("장소 이름 입력")
             
         if sel_place:
-            if sel_place not in st.session_state['reviews']:
-                st.session_state['reviews'][sel_place] = []
-
-            with st.form("msg_form", clear_on_submit=True):
-                txt = st.text_input(f"'{sel_place}' 후기 입력")
-                if st.form_submit_button("등록"):
-                    st.session_state['reviews'][sel_place].append(txt)
-                    st.rerun()
-            
-            if st.session_state['reviews'][sel_place]:
-                st.write("---")
-                for i, msg in enumerate(st.session_state['reviews'][sel_place]):
-                    c1, c2 = st.columns([8, 1])
-                    c1.info(f"🗣️ {msg}")
-                    if c2.button("🗑️", key=f"del_{sel_place}_{i}"):
-                        del st.session_state['reviews'][sel_place][i]
-                        st.rerun()
+            render_reviews(sel_place)
 
         st.divider()
         
         # --- 추천 게시판 ---
-        st.subheader("👍 나만의 장소 추천해요")
-        with st.form("recommend_form", clear_on_submit=True):
-            rec_place = st.text_input("장소 이름")
-            rec_desc = st.text_input("이유 (한 줄)")
-            if st.form_submit_button("추천 등록"):
-                st.session_state['recommendations'].insert(0, {"place": rec_place, "desc": rec_desc})
-                st.rerun()
-        
-        for i, rec in enumerate(st.session_state['recommendations']):
-            c1, c2 = st.columns([8, 1])
-            c1.success(f"**{rec['place']}**: {rec['desc']}")
-            if c2.button("🗑️", key=f"del_rec_{i}"):
-                del st.session_state['recommendations'][i]
-                st.rerun()
+        render_recommendations()
 
     # --- AI 비서 ---
     with col_ai:
@@ -450,3 +700,4 @@ with tab3:
                 resp = get_gemini_response(prompt)
                 st.write(resp)
             st.session_state['messages'].append({"role": "assistant", "content": resp})
+            st.session_state['messages'] = st.session_state['messages'][-MAX_HISTORY:]